@@ -1,229 +1,605 @@
 # scrap/arxiv_tools.py
 import os
+import re
+import io
+import gzip
 import tarfile
 import shutil
-import time
-import random
-import threading
 import functools
+import logging
+import zlib
+from contextlib import contextmanager
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-import traceback
-from typing import List, Optional
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
 
-import arxiv
 import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+from lxml import etree
+from dateutil import parser as dtparser
 
-from .utils import ensure_dir
+try:
+    # ISA-L (SIMD) inflate, nhanh hơn zlib của stdlib 2-4 lần; không cài thì dùng gzip
+    from isal import igzip as fast_gzip
+    from isal.isal_zlib import error as _IsalError
+    # lỗi giải nén (gzip hỏng/cụt) không kế thừa OSError nên phải bắt riêng
+    DECOMPRESS_ERRORS = (zlib.error, _IsalError)
+except ImportError:
+    fast_gzip = gzip
+    DECOMPRESS_ERRORS = (zlib.error,)
 
-TEX_BIB_EXTS = {".tex", ".bib"}
+from .utils import DiskCache, TokenBucket, backoff_sleep, ensure_dir
 
-# ============ GLOBAL RATE LIMITER (>= 3s/request) ============
-class RateLimiter:
-    def __init__(self, min_interval: float = 3.5):
-        self.min_interval = float(min_interval)
-        self._lock = threading.Lock()
-        self._last = 0.0
+logger = logging.getLogger(__name__)
 
-    def acquire(self):
-        with self._lock:
-            now = time.time()
-            delta = now - self._last
-            if delta < self.min_interval:
-                time.sleep(self.min_interval - delta)
-            self._last = time.time()
+TEX_BIB_EXTS = frozenset({".tex", ".bib"})
+TEX_BIB_TUPLE = tuple(TEX_BIB_EXTS)  # cho str.endswith (một lần gọi C thay vì vòng lặp Python)
+COPY_BUFSIZE = 1 << 20  # 1 MiB buffer đọc stream tar
+DOWNLOAD_CHUNK = 64 * 1024  # r.raw -> file khi tải e-print về đĩa
+# filter="data" (3.12+, có backport ở các bản vá 3.8-3.11): chặn symlink/đường dẫn tuyệt đối/device
+EXTRACT_FILTER = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+HAS_SENDFILE = hasattr(os, "sendfile")  # không có trên Windows
 
-RATE_LIMITER = RateLimiter(3.5)
-
-# ============ arXiv CLIENT ============
-# Không dùng delay/num_retries nội bộ của lib, ta tự kiểm soát để chủ động backoff
-ARXIV_CLIENT = arxiv.Client(
-    page_size=50,
+# "[v1] Mon, 12 Jun 2017 17:57:34 UTC (1,102 KB)" trong khối Submission history của trang abs
+_RE_SUBMISSION = re.compile(
+    r"\[v(\d+)\](?:\s*</?\w+[^>]*>)*\s*(\w{3}, \d{1,2} \w{3} \d{4} \d{2}:\d{2}:\d{2} UTC)"
 )
+SUBMISSION_DATE_FMT = "%a, %d %b %Y %H:%M:%S %Z"
+_RE_VLIST = re.compile(rb"\[v(\d+)\]")
+_RE_VER_TAIL = re.compile(r"v(\d+)$")
+
+# ============ GLOBAL RATE LIMITERS ============
+# export.arxiv.org/api/query: trung bình 1 request / 3.5s, burst tối đa 3
+RATE_LIMITER = TokenBucket(capacity=3, rate=1 / 3.5)
+# arxiv.org (trang abs + e-print) có giới hạn riêng với API -> bucket riêng để không chặn lẫn nhau
+WEB_LIMITER = TokenBucket(capacity=4, rate=1.0)
+
+# ============ DISK CACHE (giữ kết quả giữa các lần chạy) ============
+# keys: "meta:{arxiv_id}" -> dict metadata gọn, "abs:{base_id}" -> [(version, date), ...],
+#       "rec:{arxiv_id}" -> ArxivRecord (kết quả gọn của get_result_by_id),
+# hết hạn sau 7 ngày để bắt kịp version mới
+CACHE_TTL_SEC = 7 * 24 * 3600
+DISK_CACHE = DiskCache(os.path.join(".cache", "arxiv.db"), ttl=CACHE_TTL_SEC)
+
 # ============ UTILITIES ============
+def _has_archive_magic(head: bytes) -> bool:
+    """gzip magic (1f 8b) hoặc chữ ký tar "ustar" ở offset 257."""
+    return head[:2] == b"\x1f\x8b" or head[257:262] == b"ustar"
+
+def _looks_like_html(head: bytes) -> bool:
+    """Trang báo lỗi HTML: bắt đầu bằng '<' và có 'html' trong ~200 byte đầu (một lần lower trên 200 byte)."""
+    head = head.lstrip()
+    return head.startswith(b"<") and b"html" in head[:200].lower()
+
 def is_tar_ok(path: str) -> bool:
     """Quick validation: file exists, not an HTML error page, and tarfile can be opened."""
-    if not os.path.exists(path):
+    try:
+        st = os.stat(path)
+    except OSError:
         return False
+    # khóa theo (mtime, size): file bị ghi lại (retry tải) thì tự thành khóa mới
+    return _is_tar_ok_cached(path, st.st_mtime_ns, st.st_size)
+
+@functools.lru_cache(maxsize=1024)
+def _is_tar_ok_cached(path: str, mtime_ns: int, size: int) -> bool:
     try:
-        # fast reject: HTML error page
         with open(path, "rb") as f:
-            head = f.read(1024).lower()
-            if b"<html" in head or b"<!doctype html" in head:
-                return False
-        # try open as tar (handles .tar and .tar.gz via "r:*")
+            head = f.read(1024)
+        # fast accept: gzip magic + chữ ký "ustar" (offset 257) ở block tar đầu tiên -> chỉ đọc 512 byte
+        if head[:2] == b"\x1f\x8b":
+            with fast_gzip.open(path, "rb") as gz:
+                block = gz.read(512)
+            if len(block) == 512 and block[257:262] == b"ustar":
+                return True
+        elif head[257:262] == b"ustar":
+            return True
+        # fast reject: HTML error page (chỉ cần kiểm khi magic không khớp)
+        elif _looks_like_html(head):
+            return False
+        # chưa chắc chắn (tar kiểu cũ, nén khác...) -> mở bằng tarfile (handles .tar and .tar.gz via "r:*")
+        # và chỉ đọc header member đầu tiên, không duyệt cả archive
         with tarfile.open(path, "r:*") as tar:
-            tar.getmembers()
+            tar.next()
         return True
-    except (tarfile.TarError, OSError, EOFError):
+    except (tarfile.TarError, OSError, EOFError) + DECOMPRESS_ERRORS:
         return False
 
+def parse_versions_from_abs(html: str) -> List[Tuple[int, str]]:
+    """
+    Parse khối 'Submission history' của trang https://arxiv.org/abs/{id}
+    -> [(version, 'YYYY-MM-DD'), ...] sắp theo version.
+    Chạy regex thẳng trên HTML (không dựng cây); chỉ fallback sang BS4 + lxml khi regex không khớp.
+    """
+    matches = _RE_SUBMISSION.findall(html)
+    if not matches:
+        soup = BeautifulSoup(html, "lxml")
+        history = soup.find("div", class_="submission-history")
+        if history is None:
+            return []
+        matches = _RE_SUBMISSION.findall(history.get_text(" "))
+    dates = {}
+    for v, stamp in matches:
+        try:
+            # format cố định của arXiv -> strptime nhanh hơn nhiều so với dateutil
+            dt = datetime.strptime(stamp, SUBMISSION_DATE_FMT)
+        except ValueError:
+            dt = dtparser.parse(stamp)
+        dates.setdefault(int(v), dt.strftime("%Y-%m-%d"))
+    return sorted(dates.items())
+
 # ============ CORE API CALLS WITH RATE LIMIT + BACKOFF ============
-def _backoff_sleep(attempt: int) -> float:
-    # 1, 2, 4, 8, 16, 32 ... capped @ 60 + jitter
-    backoff = min(60, 2 ** attempt) + random.uniform(0.0, 1.5)
-    time.sleep(backoff)
-    return backoff
+# negative cache (chỉ trong process): id mà API báo không tồn tại. lru_cache không cache exception,
+# nên không có set này thì mỗi lần hỏi lại id hỏng đều tốn một slot rate limit.
+# Không lưu xuống DISK_CACHE: một lần trả lời sai không được chặn id hợp lệ qua nhiều lần chạy
+_NOT_FOUND = set()
+
+class ArxivRecord(NamedTuple):
+    """Một entry của Atom API, chỉ các field pipeline dùng; nhỏ, pickle/unpickle rẻ."""
+    entry_id: str
+    title: str
+    authors: List[str]
+    journal_ref: Optional[str]
+    comment: Optional[str]
+    published: str  # 'YYYY-MM-DD'
 
 @functools.lru_cache(maxsize=4096)
-def get_result_by_id(arxiv_id: str) -> arxiv.Result:
+def get_result_by_id(arxiv_id: str) -> ArxivRecord:
     """
-    Lấy metadata theo id (có version) với rate-limit toàn cục + retry/backoff cho 429/503.
-    Dùng lru_cache để tránh gọi lại cùng một id.
+    Lấy metadata theo id (có hoặc không kèm version -> bản mới nhất) với rate-limit toàn cục;
+    retry/backoff 429/5xx (theo Retry-After) trong _query_feed, mỗi lần thử lấy token mới.
+    Dùng lru_cache để tránh gọi lại cùng một id; DISK_CACHE để không gọi lại giữa các lần chạy.
     """
-    retries = 6
-    for attempt in range(retries):
-        try:
-            RATE_LIMITER.acquire()
-            search = arxiv.Search(id_list=[arxiv_id])
-            return next(ARXIV_CLIENT.results(search))
-        except arxiv.HTTPError as e:
-            status = getattr(e, "status", None)
-            if status in (429, 503):
-                waited = _backoff_sleep(attempt)
-                print(f"[WARN] arXiv HTTP {status} for {arxiv_id}. Backoff {waited:.1f}s (attempt {attempt+1}/{retries})")
-                continue
-            # Các lỗi khác: raise luôn
-            raise
-        except StopIteration:
+    if arxiv_id in _NOT_FOUND:
+        raise ValueError(f"arXiv ID not found: {arxiv_id}")
+    key = f"rec:{arxiv_id}"
+    cached = DISK_CACHE.get(key)
+    if cached is not None:
+        return cached
+    feed = _query_feed([arxiv_id])
+    rec = next(iter(_parse_entries(feed).values()), None)
+    if rec is None:
+        # chỉ nhớ "không tồn tại" khi feed nói rõ 0 kết quả; feed rỗng tạm thời của API thì để lần sau hỏi lại
+        if feed.findtext("os:totalResults", "", _ATOM_NS).strip() == "0":
+            _NOT_FOUND.add(arxiv_id)
             raise ValueError(f"arXiv ID not found: {arxiv_id}")
-    raise RuntimeError(f"Failed to fetch {arxiv_id} after {retries} retries")
+        raise RuntimeError(f"arXiv API returned no usable entry for {arxiv_id}")
+    DISK_CACHE.set(key, rec)
+    return rec
+
+API_URL = "https://export.arxiv.org/api/query"
+META_BATCH_SIZE = 100
+META_FETCH_WORKERS = 4  # số request lẻ chạy song song trong build_metadata (burst của RATE_LIMITER là 3)
+# "{base_id}v{n}" -> metadata (dict) đã lấy sẵn theo batch
+_META = {}
+
+_ATOM_NS = {"a": "http://www.w3.org/2005/Atom", "x": "http://arxiv.org/schemas/atom",
+            "os": "http://a9.com/-/spec/opensearch/1.1/"}
+
+API_RETRIES = 6
+API_RETRY_STATUS = (429, 500, 502, 503, 504)
+
+def _query_feed(ids: List[str]):
+    """
+    Một request Atom API cho nhiều id (id_list=a,b,c...) -> root của feed (lxml).
+    Mỗi lần thử (kể cả retry) đều qua RATE_LIMITER; 429/5xx/lỗi kết nối -> backoff_sleep
+    (theo Retry-After nếu server gửi) rồi thử lại.
+    """
+    params = {"id_list": ",".join(ids), "max_results": len(ids)}
+    for attempt in range(API_RETRIES):
+        last = attempt == API_RETRIES - 1
+        RATE_LIMITER.acquire()
+        try:
+            r = API_SESSION.get(API_URL, params=params, timeout=TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            if last:
+                raise
+            backoff_sleep(attempt)
+            continue
+        if r.status_code in API_RETRY_STATUS and not last:
+            waited = backoff_sleep(attempt, response=r)
+            logger.warning("[WARN] arXiv API HTTP %s for %s. Backoff %.1fs (attempt %d/%d)",
+                           r.status_code, params["id_list"][:40], waited, attempt + 1, API_RETRIES)
+            continue
+        r.raise_for_status()
+        return etree.fromstring(r.content)
+
+def _parse_entries(feed) -> dict:
+    """Feed -> {arxiv_id có version: ArxivRecord}; find/findtext theo namespace, không qua arxiv lib/feedparser."""
+    ns = _ATOM_NS
+    out = {}
+    for e in feed.iterfind("a:entry", ns):
+        entry_id = e.findtext("a:id", "", ns)
+        published = e.findtext("a:published", "", ns)
+        if "/abs/" not in entry_id or not published:
+            continue  # entry báo lỗi (id sai format...)
+        out[entry_id.rsplit("/abs/", 1)[1]] = ArxivRecord(
+            entry_id=entry_id,
+            title=" ".join(e.findtext("a:title", "", ns).split()),
+            authors=[a.findtext("a:name", "", ns) for a in e.iterfind("a:author", ns)],
+            journal_ref=e.findtext("x:journal_ref", None, ns),
+            comment=e.findtext("x:comment", None, ns),
+            published=published[:10],
+        )
+    return out
+
+def query_atom(ids: List[str]) -> dict:
+    """{arxiv_id có version: ArxivRecord} cho nhiều id trong một request."""
+    return _parse_entries(_query_feed(ids))
+
+def _meta_of(rec: ArxivRecord) -> dict:
+    meta = rec._asdict()
+    del meta["entry_id"]
+    return meta
+
+def fetch_meta_batch(ids: List[str]) -> dict:
+    """{arxiv_id: metadata} cho nhiều id trong một request (xem query_atom)."""
+    return {aid: _meta_of(rec) for aid, rec in query_atom(ids).items()}
+
+def prefetch_meta(ids: List[str]):
+    """
+    Lấy sẵn metadata cho các id (có version) chưa có trong cache, META_BATCH_SIZE id/request.
+    Batch lỗi -> bỏ qua, get_meta_by_id sẽ gọi lẻ từng id.
+    """
+    ids = [aid for aid in dict.fromkeys(ids) if aid not in _META and DISK_CACHE.get(f"meta:{aid}") is None]
+    for i in range(0, len(ids), META_BATCH_SIZE):
+        try:
+            _remember_meta(fetch_meta_batch(ids[i:i + META_BATCH_SIZE]))
+        except Exception:
+            continue
+
+def prefetch_metadata(base_ids: List[str]):
+    """Metadata v1 cho mọi paper trước khi crawl."""
+    prefetch_meta([f"{b}v1" for b in base_ids])
+
+def _remember_meta(got: dict):
+    _META.update(got)
+    DISK_CACHE.set_many({f"meta:{aid}": meta for aid, meta in got.items()})
+
+def get_meta_by_id(arxiv_id: str) -> dict:
+    """Metadata gọn (title, authors, journal_ref, comment, published 'YYYY-MM-DD') theo id có version."""
+    meta = _META.get(arxiv_id)
+    if meta is not None:
+        return meta
+    key = f"meta:{arxiv_id}"
+    meta = DISK_CACHE.get(key)
+    if meta is not None:
+        return meta
+    meta = _meta_of(get_result_by_id(arxiv_id))
+    DISK_CACHE.set(key, meta)
+    return meta
 
 def list_all_versions(base_id: str, v1_only: bool=False) -> List[int]:
     if v1_only:
         return [1]
-    versions, v = [], 1
-    while True:
-        try:
-            _ = get_result_by_id(f"{base_id}v{v}")
-            versions.append(v)
-            v += 1
-        except Exception:
-            break
-    return versions or [1]
+    try:
+        history = versions_and_dates(base_id)
+    except Exception:
+        history = []
+    if history:
+        return [v for v, _ in history]
+    # fallback 1: id không kèm version -> API trả bản mới nhất, entry_id kết thúc bằng vN => v1..vN
+    try:
+        latest = get_result_by_id(base_id)
+    except Exception:
+        return [1]
+    m = _RE_VER_TAIL.search(latest.entry_id)
+    if m:
+        return list(range(1, int(m.group(1)) + 1))
+    # entry_id của Atom API luôn kết thúc bằng vN; không có thì coi như chỉ có v1
+    # (không dò từng version: mỗi lần dò tốn một token chung của RATE_LIMITER)
+    return [1]
 
 UA = "Mozilla/5.0 (compatible; arxiv-crawler/1.0)"
 TIMEOUT = 30
 
-def _download_via_eprint(arxiv_id_with_ver: str, out_path: str) -> tuple[bool, str]:
+# Session cho arxiv.org (trang abs + e-print): giữ kết nối keep-alive (khỏi bắt tay TCP+TLS mỗi request).
+# Không retry trong urllib3 (max_retries=0): retry ở _web_get để lần thử nào cũng lấy token của WEB_LIMITER
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = UA
+SESSION.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=0))
+# export.arxiv.org (Atom API): session riêng, không retry trong urllib3 (max_retries=0) ->
+# retry nằm ở _query_feed để lần thử nào cũng lấy token của RATE_LIMITER
+API_SESSION = requests.Session()
+API_SESSION.headers["User-Agent"] = UA
+API_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=0))
+ABS_URL = "https://arxiv.org/abs/{base_id}"
+EPRINT_URL = "https://arxiv.org/e-print/{idv}"
+WEB_RETRIES = 4
+
+def _web_get(url: str, **kw) -> requests.Response:
+    """
+    GET arxiv.org qua SESSION; mỗi lần thử (kể cả retry) đều lấy token của WEB_LIMITER.
+    429/5xx/lỗi kết nối -> backoff_sleep (theo Retry-After nếu có) rồi thử lại, như _query_feed.
+    Lần thử cuối trả nguyên response cho caller tự xử lý status.
+    """
+    for attempt in range(WEB_RETRIES):
+        last = attempt == WEB_RETRIES - 1
+        WEB_LIMITER.acquire()
+        try:
+            r = SESSION.get(url, timeout=TIMEOUT, **kw)
+        except (requests.ConnectionError, requests.Timeout):
+            if last:
+                raise
+            backoff_sleep(attempt)
+            continue
+        if r.status_code in API_RETRY_STATUS and not last:
+            waited = backoff_sleep(attempt, response=r)
+            r.close()  # stream=True: trả kết nối về pool trước khi thử lại
+            logger.warning("[WARN] arXiv HTTP %s for %s. Backoff %.1fs (attempt %d/%d)",
+                           r.status_code, url, waited, attempt + 1, WEB_RETRIES)
+            continue
+        return r
+
+@functools.lru_cache(maxsize=4096)
+def versions_and_dates(base_id: str) -> List[Tuple[int, Optional[str]]]:
+    """
+    Một lần GET trang abs -> [(version, 'YYYY-MM-DD'), ...] cho mọi version.
+    Thay cho việc gọi API từng version (mỗi lần >= 3.5s do rate limit).
+    Nếu không đọc được ngày thì date = None (vẫn có danh sách version).
+    """
+    key = f"abs:{base_id}"
+    cached = DISK_CACHE.get(key)
+    if cached is not None:
+        return cached
+    r = _web_get(ABS_URL.format(base_id=base_id))
+    r.raise_for_status()
+    history = parse_versions_from_abs(r.text)
+    if not history:
+        # không parse được ngày -> vẫn đếm marker [vN] trên bytes (không cần decode)
+        history = [(v, None) for v in sorted({int(n) for n in _RE_VLIST.findall(r.content)})]
+    if history:
+        DISK_CACHE.set(key, history)
+    return history
+
+@dataclass
+class DownloadResult:
+    ok: bool
+    why: str = "OK"
+    bytes_written: int = 0
+    magic_ok: bool = False   # 1KB đầu có magic gzip/tar
+    ctype_ok: bool = False   # header Content-Type/Disposition nói tar/gzip
+
+def _download_via_eprint(arxiv_id_with_ver: str, out_path: str) -> DownloadResult:
     """
     Tải trực tiếp từ e-print endpoint: https://arxiv.org/e-print/{idv}
     - Không dùng seek trên stream
     - Buffer vài trăm byte đầu để phát hiện HTML
     """
-    url = f"https://arxiv.org/e-print/{arxiv_id_with_ver}"
+    url = EPRINT_URL.format(idv=arxiv_id_with_ver)
     try:
-        with requests.get(url, stream=True, timeout=TIMEOUT, headers={"User-Agent": UA}) as r:
+        with _web_get(url, stream=True) as r:
             status = r.status_code
             ctype  = r.headers.get("Content-Type", "")
             dispo  = r.headers.get("Content-Disposition", "")
 
             if status != 200:
-                return False, f"HTTP {status} from {url}"
-
-            # đọc stream theo chunk, vừa ghi file vừa giữ 1 buffer đầu
-            first_bytes = b""
-            wrote_any = False
-            with open(out_path, "wb") as f:
-                for chunk in r.iter_content(chunk_size=1 << 20):
-                    if not chunk:
-                        continue
-                    if not wrote_any:
-                        # lấy ~1KB đầu để check HTML
-                        take = min(len(chunk), 1024)
-                        first_bytes = chunk[:take]
-                        wrote_any = True
-                    f.write(chunk)
-
-            # nếu không ghi được gì → coi như fail
-            if not wrote_any:
-                if os.path.exists(out_path):
-                    try: os.remove(out_path)
-                    except: pass
-                return False, "Empty body"
-
-            # phát hiện trả về HTML (trang báo lỗi 200)
-            fb_lc = first_bytes.lower()
-            if (b"<html" in fb_lc) or (b"<!doctype html" in fb_lc):
-                # đọc ít nội dung text để log
-                # (không reopen file lớn; chỉ log dựa trên header & content-type)
-                if os.path.exists(out_path):
-                    try: os.remove(out_path)
-                    except: pass
-                return False, f"HTML instead of tar. Content-Type={ctype}; Disposition={dispo}"
-
-            # heuristic nhanh: nếu header nói tar/gzip thì OK, còn lại để is_tar_ok kiểm tra
-            looks_like_tar = ("tar" in ctype) or ("gzip" in ctype) or (".tar" in dispo) or (".gz" in dispo)
-            # không bắt buộc phải true ở đây; cứ trả OK để bước sau is_tar_ok quyết định
-            return True, "OK"
+                return DownloadResult(False, f"HTTP {status} from {url}")
+
+            # Content-Type text/html -> trang báo lỗi, khỏi đọc body
+            if ctype.startswith("text/html"):
+                return DownloadResult(False, f"HTML instead of tar. Content-Type={ctype}; Disposition={dispo}")
+
+            # đọc thẳng r.raw (bỏ lớp iter_content). x-gzip/gzip để nguyên: body chính là .tar.gz,
+            # ghi xuống đĩa như vậy, khỏi inflate lúc tải rồi lại kiểm/giải nén sau
+            encoding = r.headers.get("Content-Encoding", "").lower()
+            r.raw.decode_content = encoding not in ("gzip", "x-gzip")
+            # 1KB đầu: kiểm HTML trước khi mở file -> trang lỗi không bị ghi xuống đĩa
+            first_bytes = r.raw.read(1024)
+            if not first_bytes:
+                return DownloadResult(False, "Empty body")
+            magic_ok = _has_archive_magic(first_bytes)
+            # magic gzip/tar hoặc Content-Type gzip -> chắc chắn không phải HTML, bỏ qua bước kiểm
+            if not (magic_ok or "gzip" in ctype) and _looks_like_html(first_bytes):
+                return DownloadResult(False, f"HTML instead of tar. Content-Type={ctype}; Disposition={dispo}",
+                                      len(first_bytes))
+
+            # ghi vào .part rồi mới os.replace: file ở out_path luôn là bản tải trọn vẹn,
+            # bị ngắt giữa chừng thì chỉ còn .part (lần chạy sau không coi là đã tải)
+            part_path = out_path + ".part"
+            try:
+                with open(part_path, "wb") as f:
+                    f.write(first_bytes)
+                    shutil.copyfileobj(r.raw, f, length=DOWNLOAD_CHUNK)
+                    written = f.tell()
+                # body không bị giải nén -> số byte phải khớp Content-Length (nếu server gửi)
+                expected = r.headers.get("Content-Length")
+                if not r.raw.decode_content and expected and expected.isdigit() and int(expected) != written:
+                    raise IOError(f"truncated body: {written}/{expected} bytes")
+                os.replace(part_path, out_path)
+            except BaseException:
+                try: os.remove(part_path)
+                except OSError: pass
+                raise
+
+            # heuristic nhanh: header nói tar/gzip; caller dùng cùng magic_ok để quyết định có cần is_tar_ok không
+            ctype_ok = ("tar" in ctype) or ("gzip" in ctype) or (".tar" in dispo) or (".gz" in dispo)
+            return DownloadResult(True, "OK", written, magic_ok, ctype_ok)
 
     except Exception as e:
         # không còn seek nên sẽ không dính UnsupportedOperation nữa
-        return False, f"EXC {type(e).__name__}: {e}"
+        return DownloadResult(False, f"EXC {type(e).__name__}: {e}")
 
 def try_download_source(arxiv_id_with_ver: str, save_dir: str, filename: str) -> bool:
+    """
+    Tải source qua e-print endpoint. Không còn fallback arxiv.Result.download_source:
+    lib cũng tải đúng URL e-print đó, chỉ tốn thêm một lần gọi API (và một slot rate limit) để lấy Result.
+    save_dir do caller tạo sẵn.
+    """
     tgz_path = os.path.join(save_dir, filename)
-    os.makedirs(save_dir, exist_ok=True)
 
-    # 1) ƯU TIÊN E-PRINT
-    ok, why = _download_via_eprint(arxiv_id_with_ver, tgz_path)
-    if ok and is_tar_ok(tgz_path):
-        return True
-    if not ok:
-        print(f"[WARN] {arxiv_id_with_ver} e-print failed: {why}")
-    else:
-        print(f"[WARN] {arxiv_id_with_ver} e-print invalid tar; removing")
+    res = _download_via_eprint(arxiv_id_with_ver, tgz_path)
+    if res.ok:
+        # magic + header đều khớp và file đủ lớn -> tin luôn, không mở lại file để kiểm;
+        # lỡ là gzip của một file đơn thì extract_tex_bib vẫn báo ValueError
+        if res.magic_ok and res.ctype_ok and res.bytes_written > 1024:
+            return True
+        if is_tar_ok(tgz_path):
+            return True
+        logger.warning("[WARN] %s e-print invalid tar; removing", arxiv_id_with_ver)
         try: os.remove(tgz_path)
         except: pass
+    else:
+        logger.warning("[WARN] %s e-print failed: %s", arxiv_id_with_ver, res.why)
+    return False
 
-    # 2) FALLBACK: LIB ARXIV (đi qua gate + backoff)
-    try:
-        res = get_result_by_id(arxiv_id_with_ver)
-        res.download_source(dirpath=save_dir, filename=filename)
-        if not is_tar_ok(tgz_path):
-            try:
-                with open(tgz_path, "rb") as f:
-                    head = f.read(128)
-                print(f"[WARN] {arxiv_id_with_ver} invalid tar via API (head={head!r}); deleting.")
-                os.remove(tgz_path)
-            except Exception:
-                pass
-            return False
+def _sendfile_member(src_fd: int, m: tarfile.TarInfo, out_path: str):
+    """Chép data của member từ fd của tar (không nén) sang file đích bằng os.sendfile, không qua buffer Python."""
+    offset, left = m.offset_data, m.size
+    with open(out_path, "wb") as f:
+        out_fd = f.fileno()
+        while left > 0:
+            n = os.sendfile(out_fd, src_fd, offset, left)
+            if n == 0:
+                raise tarfile.ReadError(f"unexpected end of data for {m.name!r}")
+            offset += n
+            left -= n
+
+def _extract_members(tar: tarfile.TarFile, members, out_dir: str, label: str,
+                     src_fd: Optional[int] = None) -> dict:
+    """
+    Ghi các member .tex/.bib (làm phẳng thư mục) vào out_dir, đếm số file theo extension.
+    src_fd: fd của file tar không nén (mở seek được) -> chép bằng sendfile thay vì tar.extract.
+    """
+    total_files = 0
+    ext_counts = defaultdict(int)
+    # hoist ra biến local: vòng lặp chạy cho từng member, có archive hàng nghìn file nhỏ
+    basename = os.path.basename
+    extract = tar.extract
+    tex_bib = TEX_BIB_TUPLE
+    out_prefix = os.path.join(out_dir, "")
+    for m in members:
+        if not m.isfile():
+            continue
+        base = basename(m.name).replace("\x00", "")
+        if not base:
+            continue
+        total_files += 1
+        base_lc = base.lower()
+        stem, _, tail = base_lc.rpartition(".")
+        ext = "." + tail if stem and tail else "<no_ext>"
+        ext_counts[ext] += 1
+
+        if base_lc.endswith(tex_bib):
+            if src_fd is not None and not m.issparse():
+                _sendfile_member(src_fd, m, out_prefix + base)
+                continue
+            # đổi tên member thành basename để làm phẳng thư mục; tarfile tự open/copy/close
+            m.name = base
+            extract(m, path=out_dir, set_attrs=False, **EXTRACT_FILTER)
+    logger.info("[extract_tex_bib] '%s' total_files=%d, tex_extracted=%d, bib_extracted=%d",
+                label, total_files, ext_counts.get(".tex", 0), ext_counts.get(".bib", 0))
+    return {"total_files": total_files, "ext_counts": dict(ext_counts)}
+
+class _PrefixedRaw(io.RawIOBase):
+    """
+    Raw stream trả lại vài byte đã đọc trước (magic) rồi đọc tiếp từ fileobj.
+    urllib3 tự đóng r.raw khi hết body, sau đó readinto() báo "closed file" -> coi như EOF.
+    """
+    def __init__(self, head: bytes, fileobj):
+        self._head = head
+        self._src = fileobj
+
+    def readable(self) -> bool:
         return True
-    except Exception as e:
-        print(f"[EXCEPTION] {arxiv_id_with_ver}: {type(e).__name__}: {e}")
-        if os.path.exists(tgz_path):
-            try: os.remove(tgz_path)
-            except: pass
-        return False
+
+    def readinto(self, b) -> int:
+        if self._head:
+            n = min(len(b), len(self._head))
+            b[:n] = self._head[:n]
+            self._head = self._head[n:]
+            return n
+        if getattr(self._src, "closed", False):
+            return 0
+        data = self._src.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+def _open_tar_stream(fileobj) -> tarfile.TarFile:
+    """
+    Mở tar dạng stream ("r|", không seek). Payload gzip thì tự giải bằng fast_gzip (isal nếu có)
+    thay vì lớp gzip thuần Python của tarfile; còn lại để "r|*" tự nhận dạng.
+    """
+    head = fileobj.read(2)
+    src = io.BufferedReader(_PrefixedRaw(head, fileobj), buffer_size=COPY_BUFSIZE)
+    if head == b"\x1f\x8b":
+        src = fast_gzip.GzipFile(fileobj=src, mode="rb")
+    # bufsize: cỡ mỗi lần đọc stream (mặc định 10 KiB); copybufsize: buffer khi extract() chép member ra file
+    return tarfile.open(fileobj=src, mode="r|*", bufsize=COPY_BUFSIZE, copybufsize=COPY_BUFSIZE)
+
+@contextmanager
+def _staged_dir(out_dir: str):
+    """
+    Giải nén vào out_dir + ".part", xong trọn vẹn mới os.replace sang out_dir.
+    Lỗi/Ctrl+C giữa chừng -> xóa .part; out_dir không bao giờ chứa kết quả dở dang
+    (pipeline dựa vào out_dir có .tex để bỏ qua version khi chạy lại).
+    """
+    part = out_dir + ".part"
+    shutil.rmtree(part, ignore_errors=True)
+    ensure_dir(part)
+    try:
+        yield part
+    except BaseException:
+        shutil.rmtree(part, ignore_errors=True)
+        raise
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(part, out_dir)
 
 def extract_tex_bib(tar_path: str, out_dir: str):
-    ensure_dir(out_dir)
-    total_files = 0
-    ext_counts = {}
     try:
-        with tarfile.open(tar_path, "r:*") as tar:
-            for m in tar.getmembers():
-                if not m.isfile():
-                    continue
-                base = os.path.basename(m.name).replace("\x00", "")
-                if not base:
-                    continue
-                total_files += 1
-                _, ext = os.path.splitext(base)
-                ext = ext.lower() if ext else "<no_ext>"
-                ext_counts[ext] = ext_counts.get(ext, 0) + 1
-
-                if ext in TEX_BIB_EXTS:
-                    member_f = tar.extractfile(m)
-                    if member_f:
-                        out_path = os.path.join(out_dir, base)
-                        with open(out_path, "wb") as f:
-                            shutil.copyfileobj(member_f, f)
-        print(f"[extract_tex_bib] '{os.path.basename(tar_path)}' total_files={total_files}, "
-              f"tex_extracted={ext_counts.get('.tex',0)}, bib_extracted={ext_counts.get('.bib',0)}")
-        return {"total_files": total_files, "ext_counts": ext_counts}
-    except tarfile.ReadError:
-        raise ValueError("Downloaded file is not a valid tar archive")
+        with open(tar_path, "rb") as f:
+            head = f.read(262)
+        # tar không nén trên đĩa: mở "r:" (seek qua data của member không cần, khỏi đọc bỏ)
+        # và chép member bằng os.sendfile (zero-copy); gzip/nén khác vẫn đi đường stream
+        if HAS_SENDFILE and head[257:262] == b"ustar":
+            with tarfile.open(tar_path, "r:") as tar, _staged_dir(out_dir) as part:
+                return _extract_members(tar, tar, part, os.path.basename(tar_path),
+                                        src_fd=tar.fileobj.fileno())
+        # "r|*": đọc tuần tự một lượt, không dựng trước danh sách member bằng getmembers()
+        with open(tar_path, "rb", buffering=0) as raw, _open_tar_stream(raw) as tar, \
+                _staged_dir(out_dir) as part:
+            return _extract_members(tar, tar, part, os.path.basename(tar_path))
+    except (tarfile.TarError, EOFError, gzip.BadGzipFile) + DECOMPRESS_ERRORS as e:
+        raise ValueError("Downloaded file is not a valid tar archive") from e
+
+class NoSourceError(Exception):
+    """arXiv chắc chắn không có source dạng tar cho version này (4xx, HTML, không phải tar)."""
+
+def stream_extract_tex_bib(arxiv_id_with_ver: str, out_dir: str) -> Optional[dict]:
+    """
+    Tải e-print và giải nén .tex/.bib ngay trên stream HTTP (tarfile mode "r|*", không seek),
+    bỏ qua bước ghi .tar.gz tạm rồi đọc lại từ đầu.
+    - None: lỗi có thể là tạm thời (mạng đứt, 429/5xx...) -> caller fallback tải về đĩa rồi giải nén
+    - NoSourceError: chắc chắn không có source dạng tar (4xx, HTML, gzip một file, PDF...);
+      tải lại cùng URL về đĩa cũng ra kết quả đó nên caller bỏ qua luôn
+    """
+    url = EPRINT_URL.format(idv=arxiv_id_with_ver)
+    try:
+        with _web_get(url, stream=True) as r:
+            status = r.status_code
+            if status != 200:
+                if 400 <= status < 500 and status != 429:
+                    raise NoSourceError(f"HTTP {status} from {url}")
+                return None
+            if r.headers.get("Content-Type", "").startswith("text/html"):
+                raise NoSourceError(f"HTML instead of tar from {url}")
+            # Content-Encoding gzip/x-gzip (arXiv dùng x-gzip): để nguyên, _open_tar_stream tự giải bằng fast_gzip;
+            # encoding khác thì nhờ urllib3 giải trên stream
+            encoding = r.headers.get("Content-Encoding", "").lower()
+            r.raw.decode_content = encoding not in ("gzip", "x-gzip")
+            # _staged_dir dọn file dở dang nếu stream hỏng giữa chừng
+            with _open_tar_stream(r.raw) as tar, _staged_dir(out_dir) as part:
+                return _extract_members(tar, tar, part, arxiv_id_with_ver)
+    except NoSourceError:
+        raise
+    except (tarfile.ReadError, gzip.BadGzipFile) as e:
+        raise NoSourceError(f"{url} is not a tar archive: {e}")
+    except Exception:
+        # mọi lỗi khác (mạng, stream đóng giữa chừng...) coi là tạm thời
+        return None
 
 # ============ METADATA ============
 
@@ -237,16 +613,32 @@ class PaperMeta:
 
 def build_metadata(base_id: str, versions: List[int]) -> PaperMeta:
     # v1
-    res_v1 = get_result_by_id(f"{base_id}v{versions[0]}")
-    title = res_v1.title
-    authors = [a.name for a in res_v1.authors]
-    venue = res_v1.journal_ref or (res_v1.comment or None)
-
-    # timestamps cho từng version
-    revised_dates: List[str] = []
-    for v in versions:
-        res_v = get_result_by_id(f"{base_id}v{v}")
-        revised_dates.append(res_v.published.strftime("%Y-%m-%d"))
+    meta_v1 = get_meta_by_id(f"{base_id}v{versions[0]}")
+    title = meta_v1["title"]
+    authors = meta_v1["authors"]
+    venue = meta_v1["journal_ref"] or (meta_v1["comment"] or None)
+
+    # timestamps cho từng version: ưu tiên Submission history của trang abs (1 request cho mọi version),
+    # version nào thiếu mới gọi API
+    dates = {versions[0]: meta_v1["published"]}
+    if len(versions) > 1:
+        try:
+            dates.update({v: d for v, d in versions_and_dates(base_id) if d})
+        except Exception:
+            pass
+    # các version còn thiếu ngày -> gom vào một request id_list (1 slot rate limit thay vì N)
+    missing = [f"{base_id}v{v}" for v in versions if v not in dates]
+    if len(missing) > 1:
+        prefetch_meta(missing)
+    # còn sót (batch lỗi / id lẻ chưa cache) -> gọi song song, RATE_LIMITER vẫn giữ nhịp chung
+    left = [v for v in versions if v not in dates]
+    if len(left) > 1:
+        with ThreadPoolExecutor(max_workers=min(META_FETCH_WORKERS, len(left))) as ex:
+            metas = ex.map(get_meta_by_id, [f"{base_id}v{v}" for v in left])
+            dates.update((v, m["published"]) for v, m in zip(left, metas))
+    elif left:
+        dates[left[0]] = get_meta_by_id(f"{base_id}v{left[0]}")["published"]
+    revised_dates = [dates[v] for v in versions]
 
     return PaperMeta(
         paper_title=title,
@@ -3,17 +3,49 @@
 
 import argparse
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Tuple
 
 START = 198
 END   = 5197
 MONTH_PREFIX = "2404"  # e.g., 2404-00198 .. 2404-05197
+TMP_DIRS = frozenset({"tmp", "_tmp"})
+TMP_SUFFIX = ".tmp"
+PART_SUFFIX = ".part"  # thư mục giải nén dở của pipeline (bị kill giữa chừng)
 
 def expected_names() -> List[str]:
     return [f"{MONTH_PREFIX}-{i:05d}" for i in range(START, END + 1)]
 
-def scan_root(root: Path):
+def has_tmp(sub: Path) -> bool:
+    """tmp/_tmp/*.part folder hoặc file *.tmp ở bất kỳ cấp nào; dừng ngay khi gặp cái đầu tiên."""
+    stack = [str(sub)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                name = entry.name.lower()
+                # DirEntry cache sẵn kiểu file -> không stat lại
+                if entry.is_dir(follow_symlinks=False):
+                    if name in TMP_DIRS or name.endswith(PART_SUFFIX):
+                        return True
+                    stack.append(entry.path)
+                elif name.endswith(TMP_SUFFIX):
+                    return True
+    return False
+
+def check_folder(root: Path, name: str) -> Tuple[bool, bool, bool, bool]:
+    """-> (exists, has_tmp, has_metadata, has_references)"""
+    sub = root / name
+    if not sub.is_dir():
+        return False, False, True, True
+    return (
+        True,
+        has_tmp(sub),
+        (sub / "metadata.json").is_file(),
+        (sub / "references.json").is_file(),
+    )
+
+def scan_root(root: Path, max_workers: int = 16):
     want = expected_names()
     want_set = set(want)
 
@@ -21,40 +53,24 @@ def scan_root(root: Path):
     missing = sorted(n for n in want if n not in actual)
     extras  = sorted(n for n in actual if n.startswith(f"{MONTH_PREFIX}-") and n not in want_set)
 
-    has_tmp = []
+    has_tmp_list = []
     missing_meta = []
     missing_refs = []
 
-    for name in want:
-        sub = root / name
-        if not sub.is_dir():
-            continue
-
-        # ---- Check tmp / *.tmp ----
-        found_tmp = False
-        for dp, dirnames, filenames in os.walk(sub):
-            # tmp or _tmp folders
-            for d in dirnames:
-                if d.lower() in ("tmp", "_tmp"):
-                    found_tmp = True
-                    break
-            # *.tmp files
-            if any(fn.lower().endswith(".tmp") for fn in filenames):
-                found_tmp = True
+    # mỗi folder kiểm tra độc lập (chủ yếu là syscall) -> chạy song song, ex.map giữ nguyên thứ tự
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        results = ex.map(lambda n: check_folder(root, n), want)
+        for name, (exists, found_tmp, meta_ok, refs_ok) in zip(want, results):
+            if not exists:
+                continue
             if found_tmp:
-                break
-        if found_tmp:
-            has_tmp.append(name)
+                has_tmp_list.append(name)
+            if not meta_ok:
+                missing_meta.append(name)
+            if not refs_ok:
+                missing_refs.append(name)
 
-        # ---- Check metadata.json and references.json ----
-        meta = sub / "metadata.json"
-        refs = sub / "references.json"
-        if not meta.is_file():
-            missing_meta.append(name)
-        if not refs.is_file():
-            missing_refs.append(name)
-
-    return missing, has_tmp, missing_meta, missing_refs, extras
+    return missing, has_tmp_list, missing_meta, missing_refs, extras
 
 
 def main():
@@ -85,7 +101,7 @@ def main():
 
     print("\n--------------------------------\n")
 
-    print(f"[Folders containing tmp/_tmp or *.tmp] {len(has_tmp)}:")
+    print(f"[Folders containing tmp/_tmp/*.part or *.tmp] {len(has_tmp)}:")
     if has_tmp:
         print("\n".join(has_tmp))
     else:
@@ -1,11 +1,13 @@
 import argparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import atexit
 import os
 import time
 from typing import List, Tuple
-from .utils import ensure_dir
-from .pipeline import process_one_paper
+from .utils import ensure_dir, setup_logging, strip_version
+from .pipeline import process_papers
 from .range_builder import expand_many
+from .arxiv_tools import prefetch_metadata
+from .semantic_scholar import prefetch_references
 
 
 def parse_args():
@@ -20,10 +22,12 @@ def parse_args():
     ap.add_argument("--start", action="append", type=int, help="Start number in month, e.g., 198")
     ap.add_argument("--end",   action="append", type=int, help="End number in month, e.g., 5197")
     # performance knobs
-    ap.add_argument("--max-workers", type=int, default=6, help="Parallel workers for source/tex")
+    ap.add_argument("--max-workers", type=int, default=16,
+                    help="Parallel paper workers (requests are paced by the shared rate limiters)")
     ap.add_argument("--skip-ref", action="store_true", help="Skip Semantic Scholar references")
     ap.add_argument("--v1-only", action="store_true", help="Download only v1")
     ap.add_argument("--sleep-between-papers", type=float, default=0.0, help="Sleep between papers (seconds)")
+    ap.add_argument("--log-level", default="INFO", help="DEBUG/INFO/WARNING (per-paper logs from worker threads)")
     return ap.parse_args()
 
 
@@ -39,16 +43,14 @@ def collect_ids(args) -> List[str]:
         ids.extend(expand_many(month_ranges))
     if not ids:
         raise SystemExit("No IDs provided. Use --ids ... or --month ... --start ... --end ...")
-    ids = [i.split("v")[0] for i in ids]  # normalize
-    seen, ordered = set(), []
-    for i in ids:
-        if i not in seen:
-            ordered.append(i); seen.add(i)
-    return ordered
+    # normalize + dedup giữ nguyên thứ tự
+    return list(dict.fromkeys(strip_version(i) for i in ids))
 
 
 def main():
     args = parse_args()
+    # stop() lúc thoát (kể cả Ctrl+C) để flush các record còn trong queue
+    atexit.register(setup_logging(args.log_level).stop)
     # root chọn theo --out nếu có, ngược lại fallback về student-id
     root = os.path.abspath(args.out if args.out else args.student_id)
     ensure_dir(root)
@@ -60,34 +62,20 @@ def main():
     start_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time))
     print(f"[{start_str}] Start crawling {total} papers with {args.max_workers} worker(s).")
 
-    def run_one(aid: str, idx: int):
-        t0 = time.time()
-        process_one_paper(root, aid, v1_only=args.v1_only, skip_ref=args.skip_ref)
-        if args.sleep_between_papers > 0:
-            time.sleep(args.sleep_between_papers)
-        per_paper = time.time() - t0
-        since_start = time.time() - start_time
-        # return data for logging in the main thread
-        return {
-            "idx": idx,
-            "aid": aid,
-            "per_paper": per_paper,
-            "since_start": since_start,
-        }
+    # metadata v1 cho mọi paper qua arXiv API, nhiều id/request
+    prefetch_metadata(ids)
+    if not args.skip_ref:
+        # references cho mọi paper qua Semantic Scholar batch API (~500 paper/request)
+        prefetch_references(ids)
 
-    # submit all jobs and keep their original index
-    with ThreadPoolExecutor(max_workers=args.max_workers) as ex:
-        futures = {ex.submit(run_one, aid, i + 1): (i + 1, aid) for i, aid in enumerate(ids)}
-        completed = 0
-        for fut in as_completed(futures):
-            info = fut.result()
-            completed += 1
-            # English log line for each completed paper
-            now_str = time.strftime("%H:%M:%S")
-            print(
-                f"[{now_str}] Paper {info['idx']}/{total} ({info['aid']}) completed — "
-                f"duration {info['per_paper']:.2f}s, elapsed {info['since_start']:.2f}s since start."
-            )
+    for info in process_papers(root, ids, max_workers=args.max_workers, v1_only=args.v1_only,
+                               skip_ref=args.skip_ref, sleep_between_papers=args.sleep_between_papers):
+        # English log line for each completed paper
+        now_str = time.strftime("%H:%M:%S")
+        print(
+            f"[{now_str}] Paper {info['idx']}/{total} ({info['aid']}) completed — "
+            f"duration {info['per_paper']:.2f}s, elapsed {time.time() - start_time:.2f}s since start."
+        )
 
     total_time = time.time() - start_time
     print(f"All {total} papers finished in {total_time:.2f}s total.")
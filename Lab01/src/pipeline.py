@@ -1,42 +1,121 @@
+import logging
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from dataclasses import asdict
+from typing import Iterator, List, Optional
 from .utils import ensure_dir, to_yymm_id, write_json
 from .arxiv_tools import (
     list_all_versions, try_download_source, extract_tex_bib,
-    build_metadata
+    stream_extract_tex_bib, build_metadata, NoSourceError
 )
-from .utils import ensure_dir, to_yymm_id, write_json
 from .semantic_scholar import (
     get_references_with_arxiv_ids, enrich_references_with_dates
 )
 
-def process_one_paper(student_root: str, base_id: str, v1_only: bool=False, skip_ref: bool=False):
+logger = logging.getLogger(__name__)
+
+def _submit(pool: Optional[ThreadPoolExecutor], fn, *args) -> Future:
+    """pool.submit nếu có pool; không có thì chạy luôn trong thread hiện tại, vẫn trả về Future."""
+    if pool is not None:
+        return pool.submit(fn, *args)
+    fut = Future()
+    try:
+        fut.set_result(fn(*args))
+    except Exception as e:
+        fut.set_exception(e)
+    return fut
+
+def _fetch_refs(base_id: str) -> dict:
+    try:
+        refs = get_references_with_arxiv_ids(base_id)
+        return enrich_references_with_dates(refs)  # có throttle 1 req/s
+    except Exception:
+        return {}
+
+def _has_tex(out_dir: str) -> bool:
+    """out_dir chỉ xuất hiện sau khi giải nén trọn vẹn (xem _staged_dir), nên có .tex = version đã xong."""
+    try:
+        with os.scandir(out_dir) as it:
+            return any(e.name.lower().endswith(".tex") for e in it)
+    except OSError:
+        return False
+
+def _has_json(path: str) -> bool:
+    """File JSON đã ghi và có nội dung (lớn hơn "{}")."""
+    try:
+        return os.path.getsize(path) > 2
+    except OSError:
+        return False
+
+def _fetch_source(base_id: str, v: int, tex_root: str, tmp_dir: str) -> bool:
+    arxiv_id_v = f"{base_id}v{v}"
+    out_dir = os.path.join(tex_root, f"{to_yymm_id(base_id)}v{v}")
+    # chạy lại sau khi bị ngắt: version đã giải nén xong -> bỏ qua, không tải lại
+    if _has_tex(out_dir):
+        return True
+    tgz_name   = f"{to_yymm_id(base_id)}v{v}.tar.gz"
+    tgz_path   = os.path.join(tmp_dir, tgz_name)
+    # tar.gz còn sót trong _tmp từ lần chạy trước: chỉ có mặt khi đã tải trọn (ghi qua .part + Content-Length);
+    # giải nén đọc hết archive = kiểm tra đầy đủ, hỏng thì xóa và tải lại
+    if os.path.exists(tgz_path):
+        try:
+            extract_tex_bib(tgz_path, out_dir)
+            return True
+        except ValueError:
+            try: os.remove(tgz_path)
+            except OSError: pass
+    # 1) giải nén thẳng từ stream e-print (không ghi tar.gz tạm)
+    try:
+        if stream_extract_tex_bib(arxiv_id_v, out_dir) is not None:
+            return True
+    except NoSourceError as e:
+        logger.warning("[WARN] No source for %s: %s", arxiv_id_v, e)
+        return False
+    # 2) fallback: tải về _tmp rồi mới giải nén
+    ok = try_download_source(arxiv_id_v, tmp_dir, tgz_name)
+    if not ok:
+        logger.warning("[WARN] No source for %s", arxiv_id_v)
+        return False
+    try:
+        extract_tex_bib(tgz_path, out_dir)
+        return True
+    except ValueError:
+        logger.warning("[WARN] Invalid tar for %s", arxiv_id_v)
+        return False
+
+def process_one_paper(student_root: str, base_id: str, v1_only: bool=False, skip_ref: bool=False,
+                      aux_pool: Optional[ThreadPoolExecutor] = None):
+    """
+    aux_pool: pool phụ để chạy references và metadata song song với phần tải source
+    (source chạy ngay trong thread gọi hàm); None -> chạy tuần tự.
+    """
     yymm = to_yymm_id(base_id)
     paper_dir = os.path.join(student_root, yymm)
     ensure_dir(paper_dir)
     tex_root = os.path.join(paper_dir, "tex"); ensure_dir(tex_root)
     tmp_dir  = os.path.join(paper_dir, "_tmp"); ensure_dir(tmp_dir)
 
-    versions = list_all_versions(base_id, v1_only=v1_only)
-    any_ok = False
-    for v in versions:
-        arxiv_id_v = f"{base_id}v{v}"
-        tgz_name   = f"{to_yymm_id(base_id)}v{v}.tar.gz"
-        tgz_path   = os.path.join(tmp_dir, tgz_name)
-        ok = try_download_source(arxiv_id_v, tmp_dir, tgz_name)
-        if not ok:
-            print(f"[WARN] No source for {arxiv_id_v}")
-            continue
-        out_dir = os.path.join(tex_root, f"{to_yymm_id(base_id)}v{v}")
-        try:
-            extract_tex_bib(tgz_path, out_dir)
-            any_ok = True
-        except ValueError:
-            print(f"[WARN] Invalid tar for {arxiv_id_v}")
+    # references (Semantic Scholar) độc lập với arXiv -> chạy song song với phần source/metadata
+    # metadata.json / references.json đã có từ lần chạy trước -> không lấy lại
+    meta_path = os.path.join(paper_dir, "metadata.json")
+    refs_path = os.path.join(paper_dir, "references.json")
+    refs_done = _has_json(refs_path)
+    refs_future = None if skip_ref or refs_done else _submit(aux_pool, _fetch_refs, base_id)
 
+    versions = list_all_versions(base_id, v1_only=v1_only)
     # metadata & bib (không phụ thuộc có source hay không)
-    meta = build_metadata(base_id, versions)
-    write_json(os.path.join(paper_dir, "metadata.json"), asdict(meta))
+    meta_future = None if _has_json(meta_path) else _submit(aux_pool, build_metadata, base_id, versions)
+    # source: tuần tự từng version ngay trong thread của paper (WEB_LIMITER giữ nhịp),
+    # không phải xếp hàng sau các job references chạy lâu
+    results = [_fetch_source(base_id, v, tex_root, tmp_dir) for v in versions]
+    any_ok = any(results)
+
+    # chờ references trước (_fetch_refs không raise): metadata có lỗi thì job references
+    # cũng đã xong, không còn chạy mồ côi trong aux_pool
+    refs_map = refs_future.result() if refs_future is not None else None
+    if meta_future is not None:
+        write_json(meta_path, asdict(meta_future.result()))
     # try:
     #     bib = fetch_bibtex(base_id)
     #     with open(os.path.join(paper_dir, "references.bib"), "w", encoding="utf-8") as f:
@@ -45,15 +124,10 @@ def process_one_paper(student_root: str, base_id: str, v1_only: bool=False, skip
     #     pass
 
     # references.json (có throttle bên semantic_scholar.py)
-    if not skip_ref:
-        try:
-            refs = get_references_with_arxiv_ids(base_id)
-            refs_map = enrich_references_with_dates(refs)  # có throttle 1 req/s
-            write_json(os.path.join(paper_dir, "references.json"), refs_map)
-        except Exception:
-            write_json(os.path.join(paper_dir, "references.json"), {})
-    else:
-        write_json(os.path.join(paper_dir, "references.json"), {})
+    if refs_map is not None:
+        write_json(refs_path, refs_map)
+    elif not refs_done:
+        write_json(refs_path, {})
 
     # cleanup
     for fn in os.listdir(tmp_dir):
@@ -62,4 +136,44 @@ def process_one_paper(student_root: str, base_id: str, v1_only: bool=False, skip
     try: os.rmdir(tmp_dir)
     except: pass
 
-    return any_ok
\ No newline at end of file
+    return any_ok
+
+def process_papers(student_root: str, ids: List[str], max_workers: int = 16, v1_only: bool = False,
+                   skip_ref: bool = False, sleep_between_papers: float = 0.0) -> Iterator[dict]:
+    """
+    Chạy process_one_paper cho mọi id trên một ThreadPoolExecutor; yield {"idx", "aid", "per_paper"}
+    theo thứ tự hoàn thành. Toàn bộ là I/O mạng, nhịp request do các token bucket chung giữ,
+    nên pool lớn không làm vượt rate limit.
+    """
+    def run_one(aid: str, idx: int) -> dict:
+        t0 = time.time()
+        process_one_paper(student_root, aid, v1_only=v1_only, skip_ref=skip_ref, aux_pool=aux)
+        if sleep_between_papers > 0:
+            time.sleep(sleep_between_papers)
+        return {"idx": idx, "aid": aid, "per_paper": time.time() - t0}
+
+    # sliding window: chỉ giữ ~2*max_workers job trong hàng đợi thay vì submit cả nghìn future một lúc
+    window = 2 * max_workers
+    jobs = iter(enumerate(ids, start=1))
+    # pool phụ cho references + metadata: mỗi paper gửi tối đa 2 job -> 2*max_workers thread,
+    # job của paper này không bao giờ phải chờ thread bị job của paper khác giữ
+    with ThreadPoolExecutor(max_workers=2 * max_workers) as aux, \
+            ThreadPoolExecutor(max_workers=max_workers) as ex:
+        pending = set()
+        for idx, aid in jobs:
+            pending.add(ex.submit(run_one, aid, idx))
+            if len(pending) >= window:
+                break
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield fut.result()
+                    nxt = next(jobs, None)
+                    if nxt is not None:
+                        pending.add(ex.submit(run_one, nxt[1], nxt[0]))
+        except KeyboardInterrupt:
+            # Ctrl+C: bỏ các job chưa chạy, chờ job đang chạy xong rồi thoát
+            for fut in pending:
+                fut.cancel()
+            raise
@@ -1,3 +1,4 @@
+from itertools import chain
 from typing import List, Tuple
 
 def yymm_from_month(month_yyyy_mm: str) -> str:
@@ -16,7 +17,4 @@ def make_ids_for_range(month_yyyy_mm: str, start: int, end: int) -> List[str]:
     return [f"{yymm}.{i:05d}" for i in range(start, end + 1)]
 
 def expand_many(month_ranges: List[Tuple[str, int, int]]) -> List[str]:
-    ids: List[str] = []
-    for m, s, e in month_ranges:
-        ids.extend(make_ids_for_range(m, s, e))
-    return ids
+    return list(chain.from_iterable(make_ids_for_range(m, s, e) for m, s, e in month_ranges))
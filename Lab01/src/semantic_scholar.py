@@ -1,24 +1,22 @@
-import threading
-import time
 from tqdm import tqdm
 from typing import List, Dict
-from .utils import fetch, to_yymm_id
-from .arxiv_tools import get_result_by_id
+from .utils import TokenBucket, fetch, json_loads, post, strip_version, to_yymm_id
+from .arxiv_tools import get_meta_by_id, prefetch_meta
 
 SEM_SCHOLAR_BASE = "https://api.semanticscholar.org/graph/v1/paper/arXiv:{arxiv_id}"
+SEM_SCHOLAR_BATCH = "https://api.semanticscholar.org/graph/v1/paper/batch"
+SEM_BATCH_SIZE = 500  # giới hạn id/request của endpoint batch
+SEM_REF_FIELDS = "references,references.externalIds,references.title,references.authors,references.paperId"
 SEM_DELAY_SEC = 1.2
-_ss_gate = threading.Semaphore(1)
+# trung bình 1 request / SEM_DELAY_SEC, burst tối đa 2 (không ngủ thừa khi request trước đã chậm sẵn)
+_SS_LIMITER = TokenBucket(capacity=2, rate=1 / SEM_DELAY_SEC)
 
-def get_references_with_arxiv_ids(base_id: str) -> List[Dict]:
-    url = SEM_SCHOLAR_BASE.format(arxiv_id=base_id)
-    params = {
-        "fields": "references,references.externalIds,references.title,references.authors,references.paperId"
-    }
-    with _ss_gate:
-        time.sleep(SEM_DELAY_SEC)
-        data = fetch(url, params=params).json()
+# base_id -> refs đã lấy sẵn qua batch; pop ra khi paper được xử lý
+_REFS_CACHE: Dict[str, List[Dict]] = {}
+
+def _parse_references(data: Dict) -> List[Dict]:
     refs = []
-    for ref in data.get("references", []):
+    for ref in data.get("references") or []:
         ext = (ref or {}).get("externalIds") or {}
         aid = ext.get("ArXiv")
         if not aid:
@@ -33,18 +31,48 @@ def get_references_with_arxiv_ids(base_id: str) -> List[Dict]:
         })
     return refs
 
+def prefetch_references(base_ids: List[str]):
+    """
+    Lấy references cho nhiều paper bằng POST /paper/batch (tối đa 500 id/request)
+    thay vì 1 request/paper. Batch lỗi thì bỏ qua, paper đó sẽ fallback gọi lẻ.
+    """
+    for i in range(0, len(base_ids), SEM_BATCH_SIZE):
+        batch = base_ids[i:i + SEM_BATCH_SIZE]
+        _SS_LIMITER.acquire()
+        try:
+            data = json_loads(post(SEM_SCHOLAR_BATCH, params={"fields": SEM_REF_FIELDS},
+                                     json_body={"ids": [f"arXiv:{bid}" for bid in batch]}).content)
+        except Exception:
+            continue
+        # response là list cùng thứ tự với batch; id không tìm thấy -> None
+        for bid, item in zip(batch, data):
+            if item is not None:
+                _REFS_CACHE[bid] = _parse_references(item)
+
+def get_references_with_arxiv_ids(base_id: str) -> List[Dict]:
+    cached = _REFS_CACHE.pop(base_id, None)
+    if cached is not None:
+        return cached
+    url = SEM_SCHOLAR_BASE.format(arxiv_id=base_id)
+    params = {"fields": SEM_REF_FIELDS}
+    _SS_LIMITER.acquire()
+    data = json_loads(fetch(url, params=params).content)
+    return _parse_references(data)
+
 def enrich_references_with_dates(refs: List[Dict]) -> Dict[str, Dict]:
     out = {}
+    # metadata v1 của mọi reference: gom thành vài request id_list thay vì 1 request/reference
+    prefetch_meta([f"{strip_version(r['arxiv_id'])}v1" for r in refs])
     for r in tqdm(refs, desc="Fetching referenced arXiv metadata"):
         aid = r["arxiv_id"]
-        base = aid.split("v")[0]
+        base = strip_version(aid)
         try:
-            res_v1 = get_result_by_id(f"{base}v1")
+            meta_v1 = get_meta_by_id(f"{base}v1")
             yymm = to_yymm_id(base)
             out[yymm] = {
                 "paper_title": r["title"],
                 "authors": r["authors"],
-                "submission_date": res_v1.published.strftime("%Y-%m-%d"),
+                "submission_date": meta_v1["published"],
                 "semantic_scholar_id": r["s2id"],
             }
         except Exception:
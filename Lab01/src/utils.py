@@ -1,27 +1,186 @@
-import os
-import re
+import functools
 import json
+import logging
+import logging.handlers
+import os
+import pickle
+import queue
+import random
+import sqlite3
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:  # không có orjson -> json stdlib (chậm hơn, cùng output)
+    orjson = None
 
 HEADERS = {"User-Agent": "HCMUS-DataScience-Lab/1.0"}
 
+# Session dùng chung cho fetch/post (Semantic Scholar...): keep-alive, khỏi bắt tay TCP+TLS mỗi request
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=0))
+SESSION.headers.update(HEADERS)
+SESSION.headers["Accept-Encoding"] = "gzip, deflate"
+
+def strip_version(arxiv_id: str) -> str:
+    """'2404.00198v2' -> '2404.00198'. Cắt chuỗi thay vì regex/split (an toàn với id cũ như 'solv-int/...')."""
+    i = arxiv_id.rfind("v")
+    return arxiv_id[:i] if i > 0 and arxiv_id[i + 1:].isdigit() else arxiv_id
+
+@functools.lru_cache(maxsize=4096)
 def to_yymm_id(arxiv_id: str) -> str:
     """'1706.03762' -> '1706-03762'. Giữ nguyên phần 'vX' nếu có."""
-    v = ""
-    m = re.search(r"v(\d+)$", arxiv_id)
-    if m:
-        v = m.group(0)
-        arxiv_id = arxiv_id[: -(len(v))]
-    return arxiv_id.replace(".", "-") + v
+    base = strip_version(arxiv_id)
+    return base.replace(".", "-") + arxiv_id[len(base):]
+
+def retry_after_seconds(response) -> Optional[float]:
+    """Header Retry-After (số giây hoặc HTTP-date) -> số giây phải chờ; None nếu không có/không đọc được."""
+    value = (getattr(response, "headers", None) or {}).get("Retry-After")
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_sleep(attempt: int, response=None, base: float = 1.0, cap: float = 60.0) -> float:
+    """
+    Server có Retry-After -> chờ đúng chừng đó (+ chút jitter);
+    không có -> exponential backoff kiểu "full jitter": uniform(0, min(cap, base * 2^attempt)).
+    """
+    wait = retry_after_seconds(response) if response is not None else None
+    if wait is not None:
+        wait += random.uniform(0.0, 1.0)
+    else:
+        wait = random.uniform(0.0, min(cap, base * 2 ** attempt))
+    time.sleep(wait)
+    return wait
+
+class TokenBucket:
+    """
+    Token bucket: nạp lại `rate` token/giây, tối đa `capacity` token.
+    Trung bình 1 request / (1/rate) giây nhưng cho phép burst ngắn tới `capacity` request.
+    Token có thể âm = chỗ đã giữ cho thread đang chờ; giữ chỗ trong lock rồi mới sleep ngoài lock
+    (không thread nào giữ lock trong lúc sleep).
+    """
+    def __init__(self, capacity: float = 3, rate: float = 1 / 3.5):
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+def setup_logging(level: str = "INFO") -> logging.handlers.QueueListener:
+    """
+    Worker chỉ đẩy record vào queue (QueueHandler), một thread nền (QueueListener) ghi ra stderr
+    -> không giành lock stdout giữa các worker. Caller gọi .stop() khi xong để flush.
+    """
+    q = queue.SimpleQueue()
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter("%(message)s"))
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    root.handlers[:] = [logging.handlers.QueueHandler(q)]
+    listener = logging.handlers.QueueListener(q, stream, respect_handler_level=True)
+    listener.start()
+    return listener
 
 def ensure_dir(p: str):
     os.makedirs(p, exist_ok=True)
 
+def json_dumps(obj) -> bytes:
+    """JSON bytes UTF-8, indent 2, không escape unicode; key không phải str (vd. int) đổi thành str."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+json_loads = orjson.loads if orjson is not None else json.loads
+
 def write_json(path: str, obj):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=4)
+    # serialize một lần ra bytes, ghi vào .tmp rồi os.replace: path không bao giờ là file ghi dở
+    # (pipeline coi metadata.json/references.json đã có là xong khi chạy lại)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(json_dumps(obj))
+    os.replace(tmp, path)
 
-def fetch(url: str, params=None) -> requests.Response:
-    r = requests.get(url, params=params, headers=HEADERS, timeout=60)
+RETRY_STATUS = (429, 503)
+HTTP_RETRIES = 4
+
+def _request(method: str, url: str, **kw) -> requests.Response:
+    """429/503 -> chờ theo Retry-After của server (không có thì full jitter) rồi thử lại."""
+    for attempt in range(HTTP_RETRIES):
+        r = SESSION.request(method, url, timeout=60, **kw)
+        if r.status_code not in RETRY_STATUS or attempt == HTTP_RETRIES - 1:
+            break
+        backoff_sleep(attempt, response=r)
     r.raise_for_status()
     return r
+
+def fetch(url: str, params=None) -> requests.Response:
+    return _request("GET", url, params=params)
+
+def post(url: str, params=None, json_body=None) -> requests.Response:
+    return _request("POST", url, params=params, json=json_body)
+
+class DiskCache:
+    """
+    Cache key -> value (pickle) trên sqlite, sống qua các lần chạy lại.
+    ttl (giây): bản ghi cũ hơn coi như không có (invalidate lười lúc đọc); None = không hết hạn.
+    Mở kết nối lười (lần get/set đầu tiên); một lock chung cho mọi thread.
+    """
+    def __init__(self, path: str, ttl: Optional[float] = None):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            ensure_dir(os.path.dirname(self.path) or ".")
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB, ts REAL)")
+        return self._conn
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            row = self._db().execute("SELECT value, ts FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        if self.ttl is not None and time.time() - row[1] > self.ttl:
+            return default
+        try:
+            return pickle.loads(row[0])
+        except Exception:
+            return default
+
+    def set(self, key: str, value):
+        self.set_many({key: value})
+
+    def set_many(self, items: dict):
+        """Ghi nhiều key trong một transaction (một lần commit)."""
+        now = time.time()
+        rows = [(k, pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL), now) for k, v in items.items()]
+        with self._lock:
+            db = self._db()
+            db.executemany("INSERT OR REPLACE INTO kv (key, value, ts) VALUES (?, ?, ?)", rows)
+            db.commit()
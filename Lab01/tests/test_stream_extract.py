@@ -0,0 +1,131 @@
+"""
+Round-trip: server HTTP local trả e-print (tar / tar.gz, có hoặc không Content-Encoding: x-gzip),
+stream_extract_tex_bib phải giải được .tex/.bib qua r.raw thật của urllib3.
+Chạy: python -m unittest discover -s tests -t .  (từ thư mục Lab01)
+"""
+import gzip
+import http.server
+import io
+import os
+import tarfile
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from src import arxiv_tools
+
+FILES = [
+    ("sub/main.tex", b"\\documentclass{article}\n" * 2000),
+    ("refs.bib", b"@article{x, title={T}}\n"),
+    ("fig.png", os.urandom(300_000)),
+]
+
+def _make_tar(mode: str) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tar:
+        for name, data in FILES:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+BODIES = {"tgz": _make_tar("w:gz"), "tar": _make_tar("w")}
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    flaky_hits = 0
+
+    def do_GET(self):
+        kind, _, _ = self.path.strip("/").partition("/")
+        if kind == "flaky":
+            # lần đầu 503, sau đó trả tar.gz
+            _Handler.flaky_hits += 1
+            kind = "503" if _Handler.flaky_hits == 1 else "tgz"
+        if kind in ("404", "503"):
+            self.send_response(int(kind))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if kind == "html":
+            body = b"<html>no source</html>"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        body = BODIES[kind.replace("-xgz", "")]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-eprint-tar")
+        if kind.endswith("-xgz"):
+            self.send_header("Content-Encoding", "x-gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class StreamExtractTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = "http://127.0.0.1:%d" % cls.server.server_address[1]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def _stream(self, kind: str, out_dir: str, acquire=lambda: None):
+        with mock.patch.object(arxiv_tools, "EPRINT_URL", self.base + "/" + kind + "/{idv}"), \
+                mock.patch.object(arxiv_tools.WEB_LIMITER, "acquire", acquire), \
+                mock.patch.object(arxiv_tools, "backoff_sleep", lambda *a, **kw: 0.0):
+            return arxiv_tools.stream_extract_tex_bib("2301.00001v1", out_dir)
+
+    def _roundtrip(self, kind: str):
+        with tempfile.TemporaryDirectory() as tmp:
+            out_dir = os.path.join(tmp, "2301.00001v1")
+            stats = self._stream(kind, out_dir)
+            self.assertIsNotNone(stats)
+            self.assertEqual(stats["total_files"], 3)
+            self.assertEqual(sorted(os.listdir(out_dir)), ["main.tex", "refs.bib"])
+            with open(os.path.join(out_dir, "main.tex"), "rb") as f:
+                self.assertEqual(f.read(), FILES[0][1])
+            self.assertFalse(os.path.exists(out_dir + ".part"))
+
+    def test_gzip(self):
+        self._roundtrip("tgz")
+
+    def test_gzip_content_encoding(self):
+        self._roundtrip("tgz-xgz")
+
+    def test_plain_tar(self):
+        self._roundtrip("tar")
+
+    def test_gzip_stdlib_fallback(self):
+        with mock.patch.object(arxiv_tools, "fast_gzip", gzip):
+            self._roundtrip("tgz")
+            self._roundtrip("tgz-xgz")
+
+    def test_no_source(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for kind in ("404", "html"):
+                with self.assertRaises(arxiv_tools.NoSourceError):
+                    self._stream(kind, os.path.join(tmp, "out"))
+
+    def test_transient_is_none(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertIsNone(self._stream("503", os.path.join(tmp, "out")))
+
+    def test_retry_takes_limiter_token(self):
+        tokens = []
+        with tempfile.TemporaryDirectory() as tmp:
+            stats = self._stream("flaky", os.path.join(tmp, "out"), acquire=lambda: tokens.append(1))
+        self.assertIsNotNone(stats)
+        self.assertEqual(_Handler.flaky_hits, 2)
+        self.assertEqual(len(tokens), 2)
+
+if __name__ == "__main__":
+    unittest.main()